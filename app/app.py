@@ -1,28 +1,34 @@
+import io
+import sys
 import streamlit as st
 import pandas as pd
 import streamlit.components.v1 as components
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+from store import CaseStore, STORE_PATH, SUBGROUP_FIELDS
+from metrics import compute_signals
+from report import write_signal_report
+
 # CONFIG
 ST_PAGE_TITLE = "PV Signal Mini-Lab"
-DATA_DIR = Path(__file__).parent.parent / "data/processed"
 OUTPUT_DIR = Path(__file__).parent.parent / "outputs"
 FIG_DIR = OUTPUT_DIR / "figures"
 
 st.set_page_config(page_title=ST_PAGE_TITLE, layout="wide")
 
 # LOAD DATA
-@st.cache_data
+@st.cache_resource
 def load_data():
     try:
-        clean_df = pd.read_csv(DATA_DIR / "clean_data.csv")
+        store = CaseStore.load(STORE_PATH)
         signals_df = pd.read_csv(OUTPUT_DIR / "tables/signals.csv")
         
-        if clean_df.empty or signals_df.empty:
+        if store.n_cases == 0 or signals_df.empty:
             st.error("⚠️ Data files are empty. Regenerate data.")
             st.stop()
             
-        return clean_df, signals_df
+        return store, signals_df
     except FileNotFoundError as e:
         st.error(f"❌ Data file not found: {e}")
         st.stop()
@@ -30,11 +36,31 @@ def load_data():
         st.error(f"❌ Error loading data: {e}")
         st.stop()
 
-df_clean, df_signals = load_data()
+store, df_signals = load_data()
+df_signals_all = df_signals
+
+@st.cache_data
+def load_subgroup_signals(_store, filters):
+    """Full PRR/ROR recomputation restricted to a subgroup (bitmap AND/OR)."""
+    mask = _store.subgroup_mask(dict(filters))
+    return compute_signals(_store, mask=mask).reset_index(drop=True), int(mask.sum())
+
+def build_signal_report(store, signals_df, filters, min_a, drugs, watchlist_only):
+    """Streamed multi-sheet Excel report for the signals currently shown."""
+    mask = store.subgroup_mask(dict(filters)) if filters else None
+    subgroup = " AND ".join(f"{field} in ({', '.join(labels)})" for field, labels in filters)
+    buffer = io.BytesIO()
+    write_signal_report(store, signals_df, buffer, mask=mask, subgroup=subgroup,
+                        min_a=min_a, drugs=drugs, watchlist_only=watchlist_only)
+    return buffer.getvalue()
 
 # SESSION STATE
-if 'selected_signal_idx' not in st.session_state:
-    st.session_state.selected_signal_idx = None
+if 'selected_signal' not in st.session_state:
+    st.session_state.selected_signal = None  # (drug_name, event_pt)
+if 'signal_report' not in st.session_state:
+    st.session_state.signal_report = None  # (filter key, xlsx bytes)
+if 'subgroup' not in st.session_state:
+    st.session_state.subgroup = {}
 
 # SIDEBAR
 st.sidebar.title("PV Mini-Lab 🧪")
@@ -47,15 +73,54 @@ page = st.sidebar.radio(
     index=0
 )
 
+# SUBGROUP FILTER (Signal Explorer)
+SUBGROUP_LABELS = {
+    'sex': "Sex",
+    'age_band': "Age Band",
+    'serious': "Serious",
+    'reporter_type': "Reporter",
+    'report_year': "Report Year",
+}
+if page == "Signal Explorer":
+    st.sidebar.markdown("---")
+    st.sidebar.subheader("🎯 Subgroup")
+    st.sidebar.caption("Values within a field are OR-ed; fields are AND-ed.")
+    for field in SUBGROUP_FIELDS:
+        st.session_state.subgroup[field] = st.sidebar.multiselect(
+            SUBGROUP_LABELS[field],
+            list(store.bitmaps[field]),
+            default=st.session_state.subgroup.get(field, []),
+            key=f"subgroup_{field}"
+        )
+
+subgroup_filters = tuple(
+    (field, tuple(labels)) for field, labels in st.session_state.subgroup.items() if labels
+)
+if subgroup_filters:
+    df_signals, n_subgroup = load_subgroup_signals(store, subgroup_filters)
+    subgroup_mask = store.subgroup_mask(dict(subgroup_filters))
+    st.sidebar.warning(f"🎯 **Subgroup active:** {n_subgroup} of {store.n_cases} cases")
+else:
+    subgroup_mask = None
+
+# Resolve the selected signal against the current (possibly subgroup) table
+sig = None
+if st.session_state.selected_signal is not None:
+    drug_name, event_pt = st.session_state.selected_signal
+    matches = df_signals[(df_signals['drug_name'] == drug_name) & (df_signals['event_pt'] == event_pt)]
+    if len(matches) > 0:
+        sig = matches.iloc[0]
+    else:
+        st.session_state.selected_signal = None
+
 # Show selection info in sidebar
-if st.session_state.selected_signal_idx is not None:
-    sig = df_signals.iloc[st.session_state.selected_signal_idx]
+if sig is not None:
     st.sidebar.success(f"🔍 **Selected Signal:**")
     st.sidebar.markdown(f"**Drug:** {sig['drug_name']}")
     st.sidebar.markdown(f"**Event:** {sig['event_pt']}")
     st.sidebar.markdown(f"**Cases (a):** {sig['a']}")
     if st.sidebar.button("❌ Clear Selection"):
-        st.session_state.selected_signal_idx = None
+        st.session_state.selected_signal = None
         st.rerun()
 
 # ============ PAGE: OVERVIEW ============
@@ -67,14 +132,15 @@ if page == "Overview":
     # KPIs
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
     with kpi1:
-        st.metric("Total Cases (N)", df_clean['case_id'].nunique())
+        st.metric("Total Cases (N)", store.n_cases)
     with kpi2:
-        st.metric("Drug-Event Pairs", len(df_clean))
+        st.metric("Drug-Event Pairs", store.n_pairs)
     with kpi3:
-        methadone_cases = df_clean[df_clean['drug_name'] == 'Methadone']['case_id'].nunique()
+        methadone_code = store.code('drug_name', 'Methadone')
+        methadone_cases = int(store.drug_case_counts()[methadone_code]) if methadone_code >= 0 else 0
         st.metric("Methadone Cases", methadone_cases)
     with kpi4:
-        n_signals = len(df_signals[df_signals['signal_flag'] == True])
+        n_signals = len(df_signals_all[df_signals_all['signal_flag'] == True])
         st.metric("Potential Signals", n_signals)
         
     st.markdown("---")
@@ -115,6 +181,11 @@ elif page == "Signal Explorer":
     st.title("📡 Signal Detection Explorer")
     
     st.markdown("**Methodology:** PRR/ROR screening. Threshold: `PRR ≥ 2.0` AND `a ≥ 10`.")
+    if subgroup_filters:
+        subgroup_desc = " AND ".join(
+            f"{SUBGROUP_LABELS[field]} ∈ {{{', '.join(labels)}}}" for field, labels in subgroup_filters
+        )
+        st.info(f"🎯 2x2 tables recomputed over subgroup: {subgroup_desc} (N = {n_subgroup})")
     
     # Filters
     col_f1, col_f2, col_f3 = st.columns(3)
@@ -177,7 +248,7 @@ elif page == "Signal Explorer":
             selected_idx = selected_rows.index[0]
             selected_row = filtered_signals.iloc[selected_idx]
             
-            st.session_state.selected_signal_idx = selected_idx
+            st.session_state.selected_signal = (selected_row['drug_name'], selected_row['event_pt'])
             
             st.success(f"✅ Selected: **{selected_row['drug_name']} + {selected_row['event_pt']}** | Go to 'Case Review' in sidebar.")
         
@@ -193,8 +264,26 @@ elif page == "Signal Explorer":
             st.caption("❌ = Not on Watchlist")
         
         # Download
-        csv = filtered_signals.to_csv(index=False).encode('utf-8')
-        st.download_button("📥 Download CSV", csv, "signals.csv", "text/csv")
+        col_dl1, col_dl2 = st.columns(2)
+        with col_dl1:
+            csv = filtered_signals.to_csv(index=False).encode('utf-8')
+            st.download_button("📥 Download CSV", csv, "signals.csv", "text/csv")
+        with col_dl2:
+            # Built only on request: large case listings take seconds to write
+            report_key = (min_a, tuple(filter_drug), show_watchlist_only, subgroup_filters)
+            if st.button("📊 Generate Excel Report"):
+                with st.spinner("Writing Excel report..."):
+                    xlsx = build_signal_report(
+                        store, filtered_signals, subgroup_filters,
+                        min_a, filter_drug, show_watchlist_only
+                    )
+                st.session_state.signal_report = (report_key, xlsx)
+            report = st.session_state.signal_report
+            if report is not None and report[0] == report_key:
+                st.download_button(
+                    "📥 Download Excel Report", report[1], "signal_report.xlsx",
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
     else:
         st.warning("No signals match filters. Adjust criteria.")
 
@@ -203,15 +292,16 @@ elif page == "Case Review":
     st.title("🩺 Case Review")
     
     # Check if signal was selected
-    if st.session_state.selected_signal_idx is not None:
-        sig = df_signals.iloc[st.session_state.selected_signal_idx]
+    if sig is not None:
         st.info(f"📌 Reviewing cases for: **{sig['drug_name']} + {sig['event_pt']}**")
         
         # Get matching cases
-        matching_cases = df_clean[
-            (df_clean['drug_name'] == sig['drug_name']) &
-            (df_clean['event_pt'] == sig['event_pt'])
-        ]['case_id'].unique().tolist()
+        matching_idx = store.pair_cases(
+            store.code('drug_name', sig['drug_name']),
+            store.code('event_pt', sig['event_pt']),
+            mask=subgroup_mask
+        )
+        matching_cases = store.case_labels(matching_idx)
         
         st.markdown(f"**{len(matching_cases)} case(s)** with this drug-event combination")
         
@@ -219,28 +309,30 @@ elif page == "Case Review":
         selected_case = st.selectbox("Select Case ID", matching_cases)
     else:
         st.markdown("*No signal selected. Choose a signal in 'Signal Explorer' first, or browse all cases below.*")
-        all_cases = sorted(df_clean['case_id'].unique())
+        all_cases = store.case_labels()
         selected_case = st.selectbox("Select Case ID", all_cases)
     
     if selected_case:
-        case_data = df_clean[df_clean['case_id'] == selected_case]
-        first_row = case_data.iloc[0]
+        i = store.case_index(selected_case)
         
         st.markdown("---")
         st.markdown("### Patient Demographics")
         
         c1, c2, c3, c4 = st.columns(4)
-        c1.metric("Age", first_row['age'])
-        c2.metric("Sex", first_row['sex'])
-        c3.metric("Reporter", first_row['reporter_type'])
-        c4.metric("Serious?", first_row['serious'])
+        age = store.case_age(i)
+        c1.metric("Age", age if age is not None else "Unknown")
+        c2.metric("Sex", store.vocab['sex'][store.case_codes['sex'][i]])
+        c3.metric("Reporter", store.vocab['reporter_type'][store.case_codes['reporter_type'][i]])
+        c4.metric("Serious?", store.vocab['serious'][store.case_codes['serious'][i]])
         
         st.markdown("### Drugs")
-        unique_drugs = case_data[['drug_name', 'role_cod', 'indication']].drop_duplicates()
+        case_drugs = store.case_drugs(i)
+        unique_drugs = pd.DataFrame({col: store.vocab[col][codes] for col, codes in case_drugs.items()})
         st.table(unique_drugs)
         
         st.markdown("### Events")
-        unique_events = case_data[['event_pt']].drop_duplicates()
+        case_events = store.case_events(i)
+        unique_events = pd.DataFrame({col: store.vocab[col][codes] for col, codes in case_events.items()})
         st.table(unique_events)
         
         st.info("**Medical Officer Comment:** [Placeholder for assessment]")
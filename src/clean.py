@@ -1,6 +1,8 @@
 import pandas as pd
 from pathlib import Path
 
+from store import CaseStore, STORE_PATH
+
 # CONFIG
 RAW_DIR = Path(__file__).parent.parent / "data/raw"
 PROCESSED_DIR = Path(__file__).parent.parent / "data/processed"
@@ -72,10 +74,17 @@ def clean_data():
     out_path = PROCESSED_DIR / "clean_data.csv"
     clean_df.to_csv(out_path, index=False)
     
+    # 6. CASE STORE (integer-coded, CSR case -> drugs/events)
+    store = CaseStore.from_long(clean_df)
+    store.save(STORE_PATH)
+    
     print("-" * 30)
     print("CLEANING COMPLETE")
     print(f"Output saved to: {out_path}")
     print(f"Total Analysis Rows (Pairs): {len(clean_df)}")
+    print(f"Case store saved to: {STORE_PATH}")
+    print(f"Memory: long format {clean_df.memory_usage(deep=True).sum() / 1024:.0f} KiB "
+          f"-> case store {store.nbytes / 1024:.0f} KiB")
     print("-" * 30)
     print(clean_df.head())
 
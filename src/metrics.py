@@ -3,8 +3,9 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+from store import CaseStore, STORE_PATH
+
 # CONFIG
-PROCESSED_DATA_PATH = Path(__file__).parent.parent / "data/processed/clean_data.csv"
 OUTPUT_DIR = Path(__file__).parent.parent / "outputs/tables"
 
 WATCHLIST = [
@@ -13,37 +14,35 @@ WATCHLIST = [
     "Withdrawal symptoms"
 ]
 
-def calculate_metrics():
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    
-    # 1. LOAD DATA
-    print("Loading data for metrics...")
-    df = pd.read_csv(PROCESSED_DATA_PATH)
-    
+def compute_signals(store, min_a=3, mask=None):
+    """
+    PRR/ROR table for every Drug-Event pair with at least `min_a` cases.
+    If a boolean case `mask` is given (e.g. CaseStore.subgroup_mask), the
+    whole 2x2 table is restricted to those cases.
+    """
     # Total unique cases in the full dataset (N for denominator logic)
     # Note: In a 2x2 contingency for a specific drug-event pair:
     # N is usually the Total Number of Reports in the database.
-    total_cases_N = df['case_id'].nunique()
-    
-    print(f"Total Database Cases (N): {total_cases_N}")
-    
-    # 2. AGGREGATE COUNTS (a)
-    # Count cases per Drug-Event pair
-    # We use 'case_id' nunique to be safe, though our cleaning shouldn't have dups
-    pair_counts = df.groupby(['drug_name', 'event_pt'])['case_id'].nunique().reset_index(name='a')
-    
-    # 3. CALCULATE MARGINALS
-    # Total cases per Drug (a + b)
-    drug_counts = df.groupby('drug_name')['case_id'].nunique().reset_index(name='n_drug')
-    
-    # Total cases per Event (a + c)
-    event_counts = df.groupby('event_pt')['case_id'].nunique().reset_index(name='n_event')
-    
-    # Merge marginals back to pairs
-    metrics_df = pd.merge(pair_counts, drug_counts, on='drug_name')
-    metrics_df = pd.merge(metrics_df, event_counts, on='event_pt')
-    
-    # 4. DERIVE a, b, c, d
+    total_cases_N = store.n_cases if mask is None else int(mask.sum())
+    
+    # 1. AGGREGATE COUNTS (a)
+    # Cases per observed Drug-Event pair, as sparse (drug, event, a) triplets
+    drug_idx, event_idx, pair_counts = store.pair_case_counts(mask)
+    
+    # 2. CALCULATE MARGINALS
+    # Total cases per Drug (a + b) and per Event (a + c)
+    drug_counts = store.drug_case_counts(mask)
+    event_counts = store.event_case_counts(mask)
+    
+    metrics_df = pd.DataFrame({
+        'drug_name': store.vocab['drug_name'][drug_idx],
+        'event_pt': store.vocab['event_pt'][event_idx],
+        'a': pair_counts,
+        'n_drug': drug_counts[drug_idx],
+        'n_event': event_counts[event_idx],
+    })
+    
+    # 3. DERIVE a, b, c, d
     # a = count(Drug + Event)
     # b = count(Drug + ~Event) = n_drug - a
     # c = count(~Drug + Event) = n_event - a
@@ -53,47 +52,26 @@ def calculate_metrics():
     metrics_df['c'] = metrics_df['n_event'] - metrics_df['a']
     metrics_df['d'] = total_cases_N - metrics_df['n_drug'] - metrics_df['c']
     
-    # 5. HALDANE CORRECTION (for ROR stability)
-    # If any cell is 0, add 0.5 to all.
-    # Vectorized approach: Check if a*b*c*d == 0 (actually check if any is 0 row-wise)
-    # For simplicity in this non-vectorized reading, we'll make corrected columns
-    # But let's apply it globally or row-wise.
-    # To be precise: correction is applied per row if that row has a zero.
-    
-    def calc_prr_ror(row):
-        a, b, c, d = row['a'], row['b'], row['c'], row['d']
-        
-        # Correction
-        has_zero = (a==0 or b==0 or c==0 or d==0)
-        
-        ac, bc, cc, dc = a, b, c, d
-        if has_zero:
-            ac += 0.5
-            bc += 0.5
-            cc += 0.5
-            dc += 0.5
-            
-        # PRR = (a / (a+b)) / (c / (c+d))
-        # Denom 0 check (should rarely happen with drug counts > 0)
-        try:
-            r1 = ac / (ac + bc)
-            r0 = cc / (cc + dc)
-            prr = r1 / r0 if r0 > 0 else np.nan
-        except:
-            prr = np.nan
-            
-        # ROR = (a/b) / (c/d) = (ad) / (bc)
-        try:
-            ror = (ac * dc) / (bc * cc) if (bc * cc) > 0 else np.nan
-        except:
-            ror = np.nan
-            
-        return pd.Series([prr, ror, has_zero])
-        
-    print("Calculating PRR / ROR...")
-    metrics_df[['PRR', 'ROR', 'Corrected']] = metrics_df.apply(calc_prr_ror, axis=1)
-    
-    # 6. FLAGS & FILTERING
+    # 4. HALDANE CORRECTION (for ROR stability)
+    # Correction is applied per row if that row has a zero: add 0.5 to all cells.
+    cells = metrics_df[['a', 'b', 'c', 'd']].to_numpy(dtype=float)
+    has_zero = (cells == 0).any(axis=1)
+    cells[has_zero] += 0.5
+    ac, bc, cc, dc = cells.T
+    
+    # PRR = (a / (a+b)) / (c / (c+d))
+    # ROR = (a/b) / (c/d) = (ad) / (bc)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r1 = ac / (ac + bc)
+        r0 = cc / (cc + dc)
+        prr = np.where(r0 > 0, r1 / r0, np.nan)
+        ror = np.where(bc * cc > 0, (ac * dc) / (bc * cc), np.nan)
+    
+    metrics_df['PRR'] = prr
+    metrics_df['ROR'] = ror
+    metrics_df['Corrected'] = has_zero
+    
+    # 5. FLAGS & FILTERING
     metrics_df['is_watchlist'] = metrics_df['event_pt'].isin(WATCHLIST)
     
     # Define "Signal" status
@@ -104,7 +82,6 @@ def calculate_metrics():
     # Sort: Watchlist first, then by PRR desc
     metrics_df = metrics_df.sort_values(by=['is_watchlist', 'a', 'PRR'], ascending=[False, False, False])
     
-    # 7. EXPORT
     # Select columns
     out_cols = [
         'drug_name', 'event_pt', 
@@ -113,10 +90,22 @@ def calculate_metrics():
         'is_watchlist', 'signal_flag'
     ]
     
-    # Filter for output (Drop very low counts to keep CSV clean? 
-    # Or keep all > 0? Plan said "filter for a>=3")
-    final_df = metrics_df[metrics_df['a'] >= 3][out_cols]
+    # Filter for output (plan said "filter for a>=3")
+    return metrics_df[metrics_df['a'] >= min_a][out_cols]
+
+def calculate_metrics():
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    
+    # LOAD DATA
+    print("Loading case store for metrics...")
+    store = CaseStore.load(STORE_PATH)
+    
+    print(f"Total Database Cases (N): {store.n_cases}")
+    
+    print("Calculating PRR / ROR...")
+    final_df = compute_signals(store)
     
+    # EXPORT
     out_path = OUTPUT_DIR / "signals.csv"
     final_df.to_csv(out_path, index=False)
     
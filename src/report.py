@@ -0,0 +1,192 @@
+import numpy as np
+from pathlib import Path
+from datetime import date
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import CellIsRule, FormulaRule
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+from store import CaseStore, STORE_PATH
+from metrics import compute_signals
+
+# CONFIG
+OUTPUT_DIR = Path(__file__).parent.parent / "outputs/tables"
+REPORT_NAME = "signal_report.xlsx"
+
+SIGNAL_COLS = [
+    ('drug_name', "Drug", 16), ('event_pt', "Event", 24),
+    ('a', "a", 8), ('b', "b", 8), ('c', "c", 8), ('d', "d", 8),
+    ('PRR', "PRR", 10), ('ROR', "ROR", 10),
+    ('is_watchlist', "Watchlist", 11), ('signal_flag', "Signal", 9),
+]
+SIGNAL_FIELDS = [col for col, _, _ in SIGNAL_COLS]
+NUMBER_FIELDS = ['PRR', 'ROR']  # two-decimal number format
+
+
+def _signal_col(field):
+    """Excel column letter of a SIGNAL_COLS field."""
+    return get_column_letter(SIGNAL_FIELDS.index(field) + 1)
+
+
+LISTING_COLS = [
+    ("Drug", 16), ("Event", 24), ("Case ID", 12), ("Age", 6), ("Sex", 9),
+    ("Reporter", 12), ("Serious", 9), ("Report Year", 12), ("Role", 6), ("Indication", 20),
+]
+
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+HEADER_FILL = PatternFill("solid", fgColor="1F4E78")
+SIGNAL_FILL = PatternFill("solid", fgColor="F8CBAD")
+WATCHLIST_FILL = PatternFill("solid", fgColor="FFF2CC")
+FLAG_FONT = Font(bold=True, color="C00000")
+
+
+def _header(ws, cols):
+    """Bold header row, column widths and frozen header (write-only sheets)."""
+    for idx, (_, width) in enumerate(cols):
+        ws.column_dimensions[get_column_letter(idx + 1)].width = width
+    ws.freeze_panes = "A2"
+    row = []
+    for label, _ in cols:
+        cell = WriteOnlyCell(ws, value=label)
+        cell.font = HEADER_FONT
+        cell.fill = HEADER_FILL
+        row.append(cell)
+    ws.append(row)
+
+
+def _cases_by_code(case_idx, codes, n_codes):
+    """Split incidence pairs into one sorted case-index array per code."""
+    order = np.argsort(codes, kind='stable')
+    bounds = np.cumsum(np.bincount(codes, minlength=n_codes))[:-1]
+    return np.split(case_idx[order], bounds)
+
+
+def _write_signals(ws, signals_df):
+    cols = [(label, width) for _, label, width in SIGNAL_COLS]
+    _header(ws, cols)
+
+    # Conditional formats are declared up front: write-only sheets stream rows
+    # to disk, so nothing can be revisited after it is appended.
+    # An empty table (e.g. empty subgroup) has no data range to format.
+    last = len(signals_df) + 1
+    if last > 1:
+        end, flag, watch, prr = (_signal_col(f) for f in (SIGNAL_FIELDS[-1], 'signal_flag', 'is_watchlist', 'PRR'))
+        ws.conditional_formatting.add(f"A2:{end}{last}", FormulaRule(formula=[f"${flag}2=TRUE"], fill=SIGNAL_FILL))
+        ws.conditional_formatting.add(f"A2:{end}{last}", FormulaRule(formula=[f"${watch}2=TRUE"], fill=WATCHLIST_FILL))
+        ws.conditional_formatting.add(f"{prr}2:{prr}{last}", CellIsRule(operator='greaterThanOrEqual', formula=['2'], font=FLAG_FONT))
+        ws.auto_filter.ref = f"A1:{end}{last}"
+
+    number_idx = [SIGNAL_FIELDS.index(f) for f in NUMBER_FIELDS]
+    for row in signals_df[SIGNAL_FIELDS].itertuples(index=False):
+        cells = []
+        for value in row:
+            if isinstance(value, (bool, np.bool_)):
+                value = bool(value)
+            elif isinstance(value, (np.integer, int)):
+                value = int(value)
+            elif isinstance(value, (np.floating, float)):
+                value = None if np.isnan(value) else float(value)
+            cells.append(value)
+        for i in number_idx:
+            cell = WriteOnlyCell(ws, value=cells[i])
+            cell.number_format = "0.00"
+            cells[i] = cell
+        ws.append(cells)
+
+
+def _write_case_listing(ws, store, signals_df, mask=None):
+    """One row per (signal, case), streamed straight from the CaseStore arrays."""
+    _header(ws, LISTING_COLS)
+
+    # Cases per drug / per event once, then intersect per signal
+    d_case, d_code = store.case_drug_pairs(mask)
+    e_case, e_code = store.case_event_pairs(mask)
+    drug_cases = _cases_by_code(d_case, d_code, store.n_drugs)
+    event_cases = _cases_by_code(e_case, e_code, store.n_events)
+
+    sex = store.vocab['sex'][store.case_codes['sex']]
+    reporter = store.vocab['reporter_type'][store.case_codes['reporter_type']]
+    serious = store.vocab['serious'][store.case_codes['serious']]
+    role_vocab, indication_vocab = store.vocab['role_cod'], store.vocab['indication']
+    drug_rows = store.drug_codes['drug_name']
+    case_labels = store.case_labels()
+
+    n_rows = 0
+    for drug_name, event_pt in signals_df[['drug_name', 'event_pt']].itertuples(index=False):
+        drug, event = store.code('drug_name', drug_name), store.code('event_pt', event_pt)
+        if drug < 0 or event < 0:
+            continue
+        for i in np.intersect1d(drug_cases[drug], event_cases[event]):
+            # Role/indication of the signal drug within this case (first record)
+            lo = store.drug_offsets[i]
+            j = lo + np.flatnonzero(drug_rows[lo:store.drug_offsets[i + 1]] == drug)[0]
+            ws.append([
+                drug_name, event_pt, case_labels[i], store.case_age(i),
+                str(sex[i]), str(reporter[i]), str(serious[i]), int(store.report_year[i]),
+                str(role_vocab[store.drug_codes['role_cod'][j]]),
+                str(indication_vocab[store.drug_codes['indication'][j]]),
+            ])
+            n_rows += 1
+    return n_rows
+
+
+def _write_methodology(ws, n_cases, n_signals, subgroup=None, min_a=3, drugs=None, watchlist_only=False):
+    ws.column_dimensions['A'].width = 28
+    ws.column_dimensions['B'].width = 80
+    title = WriteOnlyCell(ws, value="PV Signal Mini-Lab — Signal Report")
+    title.font = Font(bold=True, size=14)
+    ws.append([title])
+    ws.append(["Generated", date.today().isoformat()])
+    ws.append(["Disclaimer", "SIMULATED data. Exploratory screening only; does not establish causality."])
+    ws.append([])
+    ws.append(["Cases (N)", n_cases])
+    ws.append(["Drug-Event pairs reported", n_signals])
+    ws.append(["Subgroup", subgroup or "All cases"])
+    ws.append(["Drug filter", ", ".join(drugs) if drugs else "All drugs"])
+    ws.append(["Watchlist only", "Yes" if watchlist_only else "No"])
+    ws.append([])
+    ws.append(["2x2 table", "a = Drug+Event, b = Drug+~Event, c = ~Drug+Event, d = ~Drug+~Event (case counts)"])
+    ws.append(["PRR", "(a / (a + b)) / (c / (c + d))"])
+    ws.append(["ROR", "(a / b) / (c / d)"])
+    ws.append(["Correction", "Haldane: if any cell is 0, add 0.5 to all cells."])
+    ws.append(["Signal criteria", "a ≥ 10 AND PRR ≥ 2.0"])
+    ws.append(["Screening threshold", f"Pairs with a ≥ {min_a} are listed."])
+    ws.append(["Formatting", "Red rows = signal flag; yellow rows = watchlist event; bold red PRR = PRR ≥ 2.0."])
+
+
+def write_signal_report(store, signals_df, out, mask=None, subgroup=None,
+                        min_a=3, drugs=None, watchlist_only=False):
+    """
+    Write the multi-sheet signal workbook to `out` (path or file-like object)
+    using openpyxl's write-only mode, so memory stays bounded however many
+    case-listing rows are produced. `min_a`, `drugs` and `watchlist_only`
+    describe the filters already applied to `signals_df` and are recorded on
+    the Methodology sheet. Returns the number of case-listing rows.
+    """
+    wb = Workbook(write_only=True)
+    _write_signals(wb.create_sheet("Signals"), signals_df)
+    n_rows = _write_case_listing(wb.create_sheet("Case Listing"), store, signals_df, mask)
+    n_cases = store.n_cases if mask is None else int(mask.sum())
+    _write_methodology(wb.create_sheet("Methodology"), n_cases, len(signals_df), subgroup,
+                       min_a=min_a, drugs=drugs, watchlist_only=watchlist_only)
+    wb.save(out)
+    return n_rows
+
+
+def generate_report():
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    print("Loading case store for report...")
+    store = CaseStore.load(STORE_PATH)
+    signals_df = compute_signals(store)
+
+    out_path = OUTPUT_DIR / REPORT_NAME
+    n_rows = write_signal_report(store, signals_df, out_path)
+
+    print(f"Signal report saved to: {out_path}")
+    print(f"Signals: {len(signals_df)} | Case listing rows: {n_rows}")
+
+if __name__ == "__main__":
+    generate_report()
@@ -0,0 +1,384 @@
+import re
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+# CONFIG
+STORE_PATH = Path(__file__).parent.parent / "data/processed/case_store.npz"
+
+# Case-level columns stored as integer codes into a string vocabulary
+CASE_CATEGORICALS = ['sex', 'reporter_type', 'serious']
+DRUG_CATEGORICALS = ['drug_name', 'role_cod', 'indication']
+EVENT_CATEGORICALS = ['event_pt']
+
+# Age is stored as uint8; missing ages use a sentinel outside the valid range
+AGE_UNKNOWN = 255
+AGE_MAX = AGE_UNKNOWN - 1
+
+# Age bands for subgroup screening: band k covers [EDGES[k-1], EDGES[k]),
+# plus a trailing band for unknown age
+AGE_BAND_EDGES = [18, 45, 65]
+AGE_BAND_LABELS = ['<18', '18-44', '45-64', '65+', 'Unknown']
+
+# Fields available for subgroup filters (sidebar order)
+SUBGROUP_FIELDS = ['sex', 'age_band', 'serious', 'reporter_type', 'report_year']
+
+
+def _code_dtype(n):
+    """Smallest unsigned integer dtype able to hold codes 0..n-1."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int64
+
+
+def _encode(values):
+    """Sorted string vocabulary + smallest-width codes for a column of labels."""
+    vocab, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return vocab, codes.astype(_code_dtype(len(vocab)))
+
+
+def _encode_case_ids(case_ids):
+    """
+    Pack sorted case ids. Ids sharing a prefix and a fixed-width number
+    ("CASE-0001") become int32 numbers plus a format string; anything else
+    falls back to fixed-width bytes with an empty format.
+    """
+    match = [re.fullmatch(r'(.*?)(\d+)', cid) for cid in case_ids]
+    if match and all(match):
+        prefixes = {m.group(1) for m in match}
+        widths = {len(m.group(2)) for m in match}
+        if len(prefixes) == 1 and len(widths) == 1 and widths.pop() <= 9:
+            fmt = f"{prefixes.pop().replace('%', '%%')}%0{len(match[0].group(2))}d"
+            return np.array([int(m.group(2)) for m in match], dtype=np.int32), fmt
+    return np.asarray(case_ids, dtype=np.bytes_), ''
+
+
+def _encode_age(values):
+    """
+    Whole-year ages as uint8, missing ages as AGE_UNKNOWN. Raises ValueError
+    rather than wrapping/truncating ages that do not fit.
+    """
+    values = pd.Series(values)
+    age = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    known = ~np.isnan(age)
+    bad = (values.notna().to_numpy() & ~known) | (known & ((age < 0) | (age > AGE_MAX) | (age != np.round(age))))
+    if bad.any():
+        raise ValueError(
+            f"{int(bad.sum())} case(s) have an age outside whole years 0-{AGE_MAX} "
+            f"(e.g. {values[bad].tolist()[0]!r}); fix the source data before building the store."
+        )
+    return np.where(known, age, AGE_UNKNOWN).astype(np.uint8)
+
+
+def _offsets(case_idx, n_cases):
+    """CSR offsets from a sorted array of case indices."""
+    counts = np.bincount(case_idx, minlength=n_cases)
+    offsets = np.zeros(n_cases + 1, dtype=np.int32)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+class CaseStore:
+    """
+    Compact, integer-coded in-memory model of the ICSR data.
+
+    One row per case (demographics), plus CSR-style incidence lists:
+    the drugs of case i are drug_*[drug_offsets[i]:drug_offsets[i+1]],
+    and likewise for events. Every string column is stored as the smallest
+    unsigned integer codes for its sorted vocabulary, so aggregations reduce
+    to np.bincount. Case ids are packed by _encode_case_ids; use case_labels()
+    / case_index() to convert to and from the original strings.
+    """
+
+    def __init__(self, case_ids, case_id_format, age, report_year, case_codes,
+                 drug_offsets, drug_codes, event_offsets, event_codes, vocab):
+        self.case_ids = case_ids
+        self.case_id_format = case_id_format
+        self.age = age
+        self.report_year = report_year
+        self.case_codes = case_codes        # {'sex': uint8[n_cases], ...}
+        self.drug_offsets = drug_offsets
+        self.drug_codes = drug_codes        # {'drug_name': uint*[n_drug_rows], ...}
+        self.event_offsets = event_offsets
+        self.event_codes = event_codes      # {'event_pt': uint*[n_event_rows]}
+        self.vocab = vocab                  # {'sex': str[k], 'drug_name': str[k], ...}
+        self._case_lookup = None
+        self._bitmaps = None
+
+    # ------------------------------------------------------------------
+    # CONSTRUCTION
+    # ------------------------------------------------------------------
+    @classmethod
+    def from_long(cls, df):
+        """Build a store from the Case-Drug-Event long format (clean_data.csv)."""
+        cases = df.drop_duplicates(subset=['case_id'])
+        case_labels = np.unique(cases['case_id'].to_numpy(dtype=str))
+        cases = cases.set_index('case_id').loc[case_labels]
+
+        vocab = {}
+        case_codes = {}
+        for col in CASE_CATEGORICALS:
+            vocab[col], case_codes[col] = _encode(cases[col])
+
+        # Incidence lists: one row per distinct (case, drug record) / (case, event)
+        drugs = df[['case_id'] + DRUG_CATEGORICALS].drop_duplicates()
+        events = df[['case_id'] + EVENT_CATEGORICALS].drop_duplicates()
+
+        drug_case = np.searchsorted(case_labels, drugs['case_id'].to_numpy(dtype=str))
+        event_case = np.searchsorted(case_labels, events['case_id'].to_numpy(dtype=str))
+        drug_order = np.argsort(drug_case, kind='stable')
+        event_order = np.argsort(event_case, kind='stable')
+
+        drug_codes = {}
+        for col in DRUG_CATEGORICALS:
+            vocab[col], codes = _encode(drugs[col])
+            drug_codes[col] = codes[drug_order]
+        event_codes = {}
+        for col in EVENT_CATEGORICALS:
+            vocab[col], codes = _encode(events[col])
+            event_codes[col] = codes[event_order]
+
+        case_ids, case_id_format = _encode_case_ids(case_labels.tolist())
+        return cls(
+            case_ids=case_ids,
+            case_id_format=case_id_format,
+            age=_encode_age(cases['age']),
+            report_year=cases['report_year'].to_numpy(dtype=np.int16),
+            case_codes=case_codes,
+            drug_offsets=_offsets(drug_case, len(case_labels)),
+            drug_codes=drug_codes,
+            event_offsets=_offsets(event_case, len(case_labels)),
+            event_codes=event_codes,
+            vocab=vocab,
+        )
+
+    # ------------------------------------------------------------------
+    # PERSISTENCE (.npz, no pickling)
+    # ------------------------------------------------------------------
+    def save(self, path=STORE_PATH):
+        arrays = {
+            'case_ids': self.case_ids,
+            'case_id_format': np.array(self.case_id_format),
+            'age': self.age,
+            'report_year': self.report_year,
+            'drug_offsets': self.drug_offsets,
+            'event_offsets': self.event_offsets,
+        }
+        for col, codes in self.case_codes.items():
+            arrays[f'case__{col}'] = codes
+        for col, codes in self.drug_codes.items():
+            arrays[f'drug__{col}'] = codes
+        for col, codes in self.event_codes.items():
+            arrays[f'event__{col}'] = codes
+        for col, values in self.vocab.items():
+            arrays[f'vocab__{col}'] = values
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path=STORE_PATH):
+        with np.load(path, allow_pickle=False) as z:
+            def group(prefix):
+                return {k[len(prefix):]: z[k] for k in z.files if k.startswith(prefix)}
+            return cls(
+                case_ids=z['case_ids'],
+                case_id_format=str(z['case_id_format']),
+                age=z['age'],
+                report_year=z['report_year'],
+                case_codes=group('case__'),
+                drug_offsets=z['drug_offsets'],
+                drug_codes=group('drug__'),
+                event_offsets=z['event_offsets'],
+                event_codes=group('event__'),
+                vocab=group('vocab__'),
+            )
+
+    # ------------------------------------------------------------------
+    # SIZES
+    # ------------------------------------------------------------------
+    @property
+    def n_cases(self):
+        return len(self.case_ids)
+
+    @property
+    def n_drugs(self):
+        return len(self.vocab['drug_name'])
+
+    @property
+    def n_events(self):
+        return len(self.vocab['event_pt'])
+
+    @property
+    def n_pairs(self):
+        """Rows in the equivalent long format (sum of D*E over cases)."""
+        return int(np.dot(np.diff(self.drug_offsets), np.diff(self.event_offsets)))
+
+    @property
+    def nbytes(self):
+        arrays = [self.case_ids, self.age, self.report_year,
+                  self.drug_offsets, self.event_offsets]
+        arrays += list(self.case_codes.values())
+        arrays += list(self.drug_codes.values())
+        arrays += list(self.event_codes.values())
+        arrays += list(self.vocab.values())
+        return sum(a.nbytes for a in arrays)
+
+    # ------------------------------------------------------------------
+    # LOOKUPS & VIEWS
+    # ------------------------------------------------------------------
+    def code(self, col, label):
+        """Integer code of a label in a vocabulary (-1 if absent)."""
+        vocab = self.vocab[col]
+        i = np.searchsorted(vocab, label)
+        return int(i) if i < len(vocab) and vocab[i] == label else -1
+
+    def case_labels(self, idx=None):
+        """Original case id strings, for all cases or the given case indices."""
+        ids = self.case_ids if idx is None else self.case_ids[idx]
+        if self.case_id_format:
+            return [self.case_id_format % n for n in ids.tolist()]
+        return [cid.decode() for cid in ids.tolist()]
+
+    def case_age(self, i):
+        """Age of case i in years, or None if unknown."""
+        age = int(self.age[i])
+        return None if age == AGE_UNKNOWN else age
+
+    def case_index(self, case_id):
+        if self._case_lookup is None:
+            self._case_lookup = {cid: i for i, cid in enumerate(self.case_labels())}
+        return self._case_lookup[case_id]
+
+    def case_drugs(self, i):
+        """Slice views of the drug codes for case i."""
+        lo, hi = self.drug_offsets[i], self.drug_offsets[i + 1]
+        return {col: codes[lo:hi] for col, codes in self.drug_codes.items()}
+
+    def case_events(self, i):
+        """Slice views of the event codes for case i."""
+        lo, hi = self.event_offsets[i], self.event_offsets[i + 1]
+        return {col: codes[lo:hi] for col, codes in self.event_codes.items()}
+
+    def drug_row_case(self):
+        """Case index of every drug row (expanded from the CSR offsets)."""
+        return np.repeat(np.arange(self.n_cases), np.diff(self.drug_offsets))
+
+    def event_row_case(self):
+        """Case index of every event row (expanded from the CSR offsets)."""
+        return np.repeat(np.arange(self.n_cases), np.diff(self.event_offsets))
+
+    def _categorical(self, col, codes):
+        return pd.Categorical.from_codes(codes, categories=self.vocab[col])
+
+    def cases_frame(self):
+        """One row per case; string columns are Categoricals over the stored codes."""
+        frame = {
+            'case_id': self.case_labels(),
+            'report_year': self.report_year,
+            'age': pd.array(self.age, dtype='UInt8'),
+        }
+        frame['age'][self.age == AGE_UNKNOWN] = pd.NA
+        for col in CASE_CATEGORICALS:
+            frame[col] = self._categorical(col, self.case_codes[col])
+        return pd.DataFrame(frame, copy=False)
+
+    # ------------------------------------------------------------------
+    # AGGREGATION (integer bincounts / sparse keys)
+    # ------------------------------------------------------------------
+    def case_drug_pairs(self, mask=None):
+        """Distinct (case, drug_name) incidences, sorted by case (optionally masked)."""
+        key = self.drug_row_case().astype(np.int64) * self.n_drugs + self.drug_codes['drug_name']
+        if mask is not None:
+            key = key[mask[key // self.n_drugs]]
+        key = np.unique(key)
+        return key // self.n_drugs, (key % self.n_drugs).astype(np.int32)
+
+    def case_event_pairs(self, mask=None):
+        """Distinct (case, event_pt) incidences, sorted by case (optionally masked)."""
+        key = self.event_row_case().astype(np.int64) * self.n_events + self.event_codes['event_pt']
+        if mask is not None:
+            key = key[mask[key // self.n_events]]
+        key = np.unique(key)
+        return key // self.n_events, (key % self.n_events).astype(np.int32)
+
+    def drug_case_counts(self, mask=None):
+        """Number of cases reporting each drug (indexed by drug code)."""
+        _, drug = self.case_drug_pairs(mask)
+        return np.bincount(drug, minlength=self.n_drugs)
+
+    def event_case_counts(self, mask=None):
+        """Number of cases reporting each event (indexed by event code)."""
+        _, event = self.case_event_pairs(mask)
+        return np.bincount(event, minlength=self.n_events)
+
+    def pair_case_counts(self, mask=None):
+        """
+        Cases per observed (drug, event) pair as sparse (drug, event, a)
+        triplets sorted by drug then event; memory scales with the data,
+        not with n_drugs * n_events.
+        """
+        d_case, d_code = self.case_drug_pairs(mask)
+        e_case, e_code = self.case_event_pairs(mask)
+        e_offsets = _offsets(e_case, self.n_cases)
+
+        # Cartesian product within each case: repeat every drug incidence
+        # once per event of its case, then walk that case's event slice.
+        n_ev = np.diff(e_offsets)[d_case]
+        total = int(n_ev.sum())
+        start = np.repeat(np.cumsum(n_ev) - n_ev, n_ev)
+        pos = np.arange(total) - start
+        event = e_code[np.repeat(e_offsets[d_case], n_ev) + pos]
+        drug = np.repeat(d_code, n_ev)
+
+        keys, counts = np.unique(drug.astype(np.int64) * self.n_events + event, return_counts=True)
+        return keys // self.n_events, keys % self.n_events, counts
+
+    def pair_cases(self, drug_code, event_code, mask=None):
+        """Case indices reporting both the given drug and event."""
+        d_case, d_code = self.case_drug_pairs(mask)
+        e_case, e_code = self.case_event_pairs(mask)
+        return np.intersect1d(d_case[d_code == drug_code], e_case[e_code == event_code])
+
+    # ------------------------------------------------------------------
+    # SUBGROUP BITMAPS
+    # ------------------------------------------------------------------
+    @property
+    def bitmaps(self):
+        """
+        Packed case bitmaps per subgroup value, built once per store:
+        {field: {label: uint8[ceil(n_cases / 8)]}}, bit i set = case i matches.
+        """
+        if self._bitmaps is None:
+            fields = {col: (self.vocab[col], self.case_codes[col]) for col in CASE_CATEGORICALS}
+            age_band = np.searchsorted(AGE_BAND_EDGES, self.age, side='right')
+            age_band[self.age == AGE_UNKNOWN] = len(AGE_BAND_EDGES) + 1
+            fields['age_band'] = (AGE_BAND_LABELS, age_band)
+            years, year_codes = np.unique(self.report_year, return_inverse=True)
+            fields['report_year'] = (years.astype(str), year_codes)
+
+            self._bitmaps = {}
+            for field, (labels, codes) in fields.items():
+                self._bitmaps[field] = {
+                    str(label): np.packbits(codes == k) for k, label in enumerate(labels)
+                }
+        return self._bitmaps
+
+    def subgroup_bitmap(self, filters):
+        """
+        Packed bitmap for a subgroup filter {field: [labels]}:
+        labels within a field are OR-ed, fields are AND-ed. Empty = all cases.
+        """
+        result = np.packbits(np.ones(self.n_cases, dtype=bool))
+        for field, labels in filters.items():
+            if not labels:
+                continue
+            field_bitmaps = self.bitmaps[field]
+            union = np.zeros_like(result)
+            for label in labels:
+                union |= field_bitmaps[str(label)]
+            result &= union
+        return result
+
+    def subgroup_mask(self, filters):
+        """Boolean case mask for a subgroup filter (see subgroup_bitmap)."""
+        return np.unpackbits(self.subgroup_bitmap(filters), count=self.n_cases).astype(bool)
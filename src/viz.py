@@ -1,21 +1,23 @@
 
 import pandas as pd
+import numpy as np
 import plotly.express as px
 from pathlib import Path
 
+from store import CaseStore, STORE_PATH
+
 # CONFIG
-PROCESSED_DATA_PATH = Path(__file__).parent.parent / "data/processed/clean_data.csv"
 OUTPUT_DIR = Path(__file__).parent.parent / "outputs/figures"
 
 def generate_visuals():
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     
     # 1. LOAD DATA
-    print("Loading processed data for viz...")
-    df = pd.read_csv(PROCESSED_DATA_PATH)
+    print("Loading case store for viz...")
+    store = CaseStore.load(STORE_PATH)
     
     # Unique cases for demographic plots
-    df_cases = df.drop_duplicates(subset=['case_id'])
+    df_cases = store.cases_frame()
     
     print(f"Generating figures for {len(df_cases)} unique cases...")
     
@@ -37,8 +39,8 @@ def generate_visuals():
     
     # --- FIG 3: Top 10 Drugs ---
     # Count by Case-Drug unique pairs
-    df_drug_cases = df[['case_id', 'drug_name']].drop_duplicates()
-    top_drugs = df_drug_cases['drug_name'].value_counts().head(10).reset_index()
+    drug_counts = pd.Series(store.drug_case_counts(), index=store.vocab['drug_name'])
+    top_drugs = drug_counts.sort_values(ascending=False).head(10).reset_index()
     top_drugs.columns = ['Drug', 'Count']
     
     fig_drugs = px.bar(
@@ -51,8 +53,8 @@ def generate_visuals():
     
     # --- FIG 4: Top 10 Events ---
     # Count by Case-Event unique pairs
-    df_event_cases = df[['case_id', 'event_pt']].drop_duplicates()
-    top_events = df_event_cases['event_pt'].value_counts().head(10).reset_index()
+    event_counts = pd.Series(store.event_case_counts(), index=store.vocab['event_pt'])
+    top_events = event_counts.sort_values(ascending=False).head(10).reset_index()
     top_events.columns = ['Event', 'Count']
     
     fig_events = px.bar(
@@ -65,9 +67,17 @@ def generate_visuals():
     
     # --- FIG 5: Serious vs Non-Serious by Drug ---
     # % Serious per drug
-    df_serious = df[['case_id', 'drug_name', 'serious']].drop_duplicates()
-    # Group by Drug + Serious
-    serious_counts = df_serious.groupby(['drug_name', 'serious']).size().reset_index(name='Count')
+    # Bincount over distinct Case-Drug incidences keyed by (drug, serious)
+    d_case, d_code = store.case_drug_pairs()
+    n_serious = len(store.vocab['serious'])
+    key = d_code.astype(np.int64) * n_serious + store.case_codes['serious'][d_case]
+    counts = np.bincount(key, minlength=store.n_drugs * n_serious)
+    serious_counts = pd.DataFrame({
+        'drug_name': np.repeat(store.vocab['drug_name'], n_serious),
+        'serious': np.tile(store.vocab['serious'], store.n_drugs),
+        'Count': counts,
+    })
+    serious_counts = serious_counts[serious_counts['Count'] > 0]
     
     fig_serious = px.bar(
         serious_counts, x="Count", y="drug_name", color="serious",
@@ -81,12 +91,16 @@ def generate_visuals():
     top_5_drugs = top_drugs['Drug'].head(5).tolist()
     top_10_events_list = top_events['Event'].head(10).tolist()
     
-    df_heat = df[
-        (df['drug_name'].isin(top_5_drugs)) & 
-        (df['event_pt'].isin(top_10_events_list))
+    drug_idx, event_idx, counts = store.pair_case_counts()
+    heatmap_data = pd.DataFrame({
+        'drug_name': store.vocab['drug_name'][drug_idx],
+        'event_pt': store.vocab['event_pt'][event_idx],
+        'Count': counts,
+    })
+    heatmap_data = heatmap_data[
+        (heatmap_data['drug_name'].isin(top_5_drugs)) & 
+        (heatmap_data['event_pt'].isin(top_10_events_list))
     ]
-    
-    heatmap_data = df_heat.groupby(['drug_name', 'event_pt']).size().reset_index(name='Count')
     heatmap_matrix = heatmap_data.pivot(index='drug_name', columns='event_pt', values='Count').fillna(0)
     
     fig_heat = px.imshow(